@@ -19,17 +19,23 @@
 
 import argparse
 import base64
-import ed25519
+import collections
 import datetime
 import hashlib
 import json
 import os
+import selectors
 import socket
 import struct
 import sys
 import threading
 import time
 
+import nacl.signing
+
+_UINT32 = struct.Struct('<I')
+_UINT64 = struct.Struct('<Q')
+
 class RoughtimeError(Exception):
     'Represents an error that has occured in the Roughtime client.'
     def __init__(self, message):
@@ -51,98 +57,145 @@ class RoughtimeServer:
     '''
     CERTIFICATE_CONTEXT = b'RoughTime v1 delegation signature--\x00'
     SIGNED_RESPONSE_CONTEXT = b'RoughTime v1 response signature\x00'
+    # Maximum number of datagrams drained from the socket per wakeup.
+    MAX_RECV_BATCH = 64
     def __init__(self, cert, pkey, radi=100000):
         cert = base64.b64decode(cert)
         pkey = base64.b64decode(pkey)
         if len(cert) != 152:
             raise RoughtimeError('Wrong CERT length.')
         self.cert = RoughtimePacket('CERT', cert)
-        self.pkey = ed25519.SigningKey(pkey)
+        self.pkey = nacl.signing.SigningKey(pkey)
         self.radi = int(radi)
 
         # Ensure that the CERT and private key are a valid pair.
-        pubkey = ed25519.VerifyingKey(self.cert.get_tag('DELE') \
+        pubkey = nacl.signing.VerifyKey(self.cert.get_tag('DELE') \
                 .get_tag('PUBK').get_value_bytes())
-        testsign = self.pkey.sign(RoughtimeServer.SIGNED_RESPONSE_CONTEXT)
+        testsign = self.pkey.sign(
+                RoughtimeServer.SIGNED_RESPONSE_CONTEXT).signature
         try:
-            pubkey.verify(testsign, RoughtimeServer.SIGNED_RESPONSE_CONTEXT)
+            pubkey.verify(RoughtimeServer.SIGNED_RESPONSE_CONTEXT, testsign)
         except:
             raise RoughtimeError('CERT and pkey arguments are not a valid '
                     + 'certificate pair.')
 
-    def start(self, ip, port):
+        # Precompute the serialized SREP skeleton. RADI never changes, so
+        # each reply batch only needs to patch in MIDP and ROOT before
+        # signing, instead of rebuilding and reserializing the packet.
+        srep = RoughtimePacket('SREP')
+        srep.add_tag(RoughtimeTag('ROOT', bytes(32)))
+        midp = RoughtimeTag('MIDP')
+        midp.set_value_uint64(0)
+        srep.add_tag(midp)
+        radi_tag = RoughtimeTag('RADI')
+        radi_tag.set_value_uint32(self.radi)
+        srep.add_tag(radi_tag)
+        self.srep_template = srep.get_value_bytes()
+        num_tags = len(srep.tags)
+        value_offset = 4 + 4 * (num_tags - 1) + 4 * num_tags
+        for tag in srep.tags:
+            if tag.key == 'MIDP':
+                self.srep_midp_offset = value_offset
+            elif tag.key == 'ROOT':
+                self.srep_root_offset = value_offset
+            value_offset += tag.get_value_len()
+
+    def start(self, ip, port, num_threads=None):
         '''
         Starts the Roughtime server.
 
         Args:
             ip (str): The IP address the server should bind to.
             port (int): The UDP port the server should bind to.
+            num_threads (int): The number of receive threads, each with its
+                    own socket bound to the port with SO_REUSEPORT so the
+                    kernel distributes datagrams between them. Defaults to
+                    the CPU count where SO_REUSEPORT is available and one
+                    otherwise.
         '''
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind((ip, port))
-        self.sock.settimeout(0.001)
+        if num_threads == None:
+            if hasattr(socket, 'SO_REUSEPORT'):
+                num_threads = os.cpu_count() or 1
+            else:
+                num_threads = 1
+        if num_threads > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            raise RoughtimeError('Multiple receive threads require '
+                    + 'SO_REUSEPORT support.')
+        self.socks = []
+        self.threads = []
         self.run = True
-        self.thread = threading.Thread(target=RoughtimeServer.__recv_thread,
-                args=(self,))
-        self.thread.start()
+        for i in range(num_threads):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if num_threads > 1:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((ip, port))
+            sock.setblocking(False)
+            thread = threading.Thread(target=RoughtimeServer.__recv_thread,
+                    args=(self, sock))
+            thread.start()
+            self.socks.append(sock)
+            self.threads.append(thread)
 
     def stop(self):
         'Stops the Roughtime server.'
         if self.run == False:
             return
         self.run = False
-        self.thread.join()
-        self.sock.close()
-        self.thread = None
-        self.sock = None
+        for thread in self.threads:
+            thread.join()
+        for sock in self.socks:
+            sock.close()
+        self.threads = []
+        self.socks = []
 
     @staticmethod
     def __clp2(x):
         'Returns the next power of two.'
-        x -= 1
-        x |= x >>  1
-        x |= x >>  2
-        x |= x >>  4
-        x |= x >>  8
-        x |= x >> 16
-        return x + 1
+        assert x > 0
+        return 1 << (x - 1).bit_length()
 
     @staticmethod
-    def __construct_merkle(nonces, prev=None, order=None):
-        'Builds a Merkle tree.'
-        # First call:  and calculate order
-        if prev == None:
-            # Hash nonces.
-            nonces = [hashlib.sha512(b'\x00' + x).digest()[:32] for x in nonces]
-            # Calculate next power of two.
-            size = RoughtimeServer.__clp2(len(nonces))
-            # Extend nonce list to the next power of two.
-            nonces += [os.urandom(64) for x in range(size - len(nonces))]
-            # Calculate list order
-            order = 0
-            while size & 1 == 0:
-                order += 1
-                size >>= 1
-            return RoughtimeServer.__construct_merkle(nonces, [nonces], order)
-
-        if order == 0:
-            return prev
-
-        out = []
-        for n in range(1 << (order - 1)):
-            out.append(hashlib.sha512(b'\x01' + nonces[n * 2]
-                    + nonces[n * 2 + 1]).digest()[:32])
-
-        prev.append(out)
-        return RoughtimeServer.__construct_merkle(out, prev, order - 1)
+    def __construct_merkle(nonces):
+        '''
+        Builds a Merkle tree. Returns a list of levels, each a flat
+        bytearray of adjacent 32 byte nodes, from the leaves up to the
+        root.
+        '''
+        # Calculate next power of two.
+        size = RoughtimeServer.__clp2(len(nonces))
+        # Hash the nonces into a flat leaf level buffer, extended to the
+        # next power of two with random leaves.
+        leaves = bytearray(size * 32)
+        for i in range(len(nonces)):
+            leaves[i * 32:(i + 1) * 32] = \
+                    hashlib.sha512(b'\x00' + nonces[i]).digest()[:32]
+        if size > len(nonces):
+            leaves[len(nonces) * 32:] = \
+                    os.urandom((size - len(nonces)) * 32)
+        # Hash pairs of adjacent nodes level by level until only the root
+        # remains. Sibling nodes are contiguous in the flat level buffer,
+        # so each hash input is the node prefix followed by a single
+        # 64 byte slice. The input buffer is reused for all pairs.
+        levels = [leaves]
+        hashbuf = bytearray(65)
+        hashbuf[0] = 0x01
+        level = leaves
+        while len(level) > 32:
+            out = bytearray(len(level) // 2)
+            for n in range(0, len(out), 32):
+                hashbuf[1:] = level[n * 2:n * 2 + 64]
+                out[n:n + 32] = hashlib.sha512(hashbuf).digest()[:32]
+            levels.append(out)
+            level = out
+        return levels
 
     @staticmethod
     def __construct_merkle_path(merkle, index):
         'Returns the Merkle tree path for a nonce index.'
         out = b''
-        while len(merkle[0]) > 1:
-            out += merkle[0][index ^ 1]
-            merkle = merkle[1:]
+        for level in merkle[:-1]:
+            sibling = index ^ 1
+            out += bytes(level[sibling * 32:(sibling + 1) * 32])
             index >>= 1
         return out
 
@@ -156,73 +209,116 @@ class RoughtimeServer:
         return timestamp
 
     @staticmethod
-    def __recv_thread(ref):
+    def __recv_thread(ref, sock):
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ)
         while ref.run:
-            try:
-                data, addr = ref.sock.recvfrom(1500)
-            except socket.timeout:
+            # Block until at least one datagram is readable, waking up
+            # periodically to check the run flag.
+            if len(sel.select(0.1)) == 0:
                 continue
-
-            # Ignore requests shorter than 1024 bytes.
-            if len(data) < 1024:
-                print("Bad length.")
+            # Drain a batch of datagrams from the socket before processing
+            # them, to amortize the wakeup cost under load.
+            batch = []
+            while len(batch) < RoughtimeServer.MAX_RECV_BATCH:
+                try:
+                    batch.append(sock.recvfrom(1500))
+                except BlockingIOError:
+                    break
+            # Validate the batch, then answer all valid requests with a
+            # single Merkle tree and signature.
+            requests = []
+            for data, addr in batch:
+                nonc = RoughtimeServer.__validate_request(data)
+                if nonc != None:
+                    requests.append((nonc, addr))
+            if len(requests) == 0:
                 continue
+            for reply, addr in RoughtimeServer.__handle_batch(ref, requests):
+                sock.sendto(reply, addr)
+        sel.close()
 
-            try:
-                request = RoughtimePacket(packet=data)
-            except:
-                print("Bad packet.")
-                continue
+    @staticmethod
+    def __validate_request(data):
+        'Parses a received request and returns its nonce, or None if invalid.'
+        # Ignore requests shorter than 1024 bytes.
+        if len(data) < 1024:
+            print("Bad length.")
+            return None
 
-            # Ensure request contains a proper nonce.
-            if request.contains_tag('NONC') == False or request.contains_tag('VER') == False:
-                print(request.tags)
-                print("Missing VER or NONC.")
-                continue
-            nonc = request.get_tag('NONC').get_value_bytes()
-            if len(nonc) != 64:
-                print("NONC != 64")
-                continue
+        try:
+            request = RoughtimePacket(packet=data)
+        except:
+            print("Bad packet.")
+            return None
 
-            noncelist = [nonc]
-            merkle = RoughtimeServer.__construct_merkle(noncelist)
-            path_bytes = RoughtimeServer.__construct_merkle_path(merkle, 0)
+        # Ensure request contains a proper nonce.
+        if request.contains_tag('NONC') == False or request.contains_tag('VER') == False:
+            print(request.tags)
+            print("Missing VER or NONC.")
+            return None
+        nonc = request.get_tag('NONC').get_value_bytes()
+        if len(nonc) != 64:
+            print("NONC != 64")
+            return None
+        return nonc
 
-            # Construct reply.
+    @staticmethod
+    def __handle_batch(ref, requests):
+        '''
+        Builds replies for a batch of (nonce, address) pairs. All requests
+        in the batch share one Merkle tree, one midpoint timestamp and one
+        signature, so the Ed25519 signing cost is amortized over the whole
+        batch. Returns a list of (reply_bytes, address) pairs.
+        '''
+        nonces = [nonc for nonc, addr in requests]
+        if len(nonces) == 1:
+            # A single-nonce reply is a one-leaf Merkle tree: the root is
+            # the hashed nonce and the path is empty.
+            merkle = None
+            root_bytes = hashlib.sha512(b'\x00' + nonces[0]).digest()[:32]
+        else:
+            merkle = RoughtimeServer.__construct_merkle(nonces)
+            root_bytes = bytes(merkle[-1])
+
+        # Tags shared by all replies in the batch. Patch the midpoint and
+        # Merkle root into the precomputed SREP skeleton; RADI was fixed
+        # at server start.
+        srep_buf = bytearray(ref.srep_template)
+        struct.pack_into('<Q', srep_buf, ref.srep_midp_offset,
+                RoughtimeServer.__datetime_to_timestamp(\
+                        datetime.datetime.now()))
+        srep_buf[ref.srep_root_offset:ref.srep_root_offset + 32] = root_bytes
+        srep_bytes = bytes(srep_buf)
+
+        srep = RoughtimeTag('SREP', srep_bytes)
+        sig = RoughtimeTag('SIG', ref.pkey.sign(
+                RoughtimeServer.SIGNED_RESPONSE_CONTEXT
+                        + srep_bytes).signature)
+
+        ver = RoughtimeTag('VER', RoughtimeTag.uint32_to_bytes(0x80000003))
+
+        replies = []
+        for i in range(len(requests)):
+            nonc, addr = requests[i]
             reply = RoughtimePacket()
             reply.add_tag(ref.cert)
-            reply.add_tag(request.get_tag('NONC'))
-            reply.add_tag(RoughtimeTag('VER', RoughtimeTag.uint32_to_bytes(0x80000003)))
+            reply.add_tag(RoughtimeTag('NONC', nonc))
+            reply.add_tag(ver)
 
-            # Single nonce Merkle tree.
             indx = RoughtimeTag('INDX')
-            indx.set_value_uint32(0)
+            indx.set_value_uint32(i)
             reply.add_tag(indx)
             path = RoughtimeTag('PATH')
-            path.set_value_bytes(path_bytes)
+            if merkle != None:
+                path.set_value_bytes(
+                        RoughtimeServer.__construct_merkle_path(merkle, i))
             reply.add_tag(path)
 
-            srep = RoughtimePacket('SREP')
-
-            root = RoughtimeTag('ROOT', merkle[-1][0])
-            srep.add_tag(root)
-
-            midp = RoughtimeTag('MIDP')
-            midp.set_value_uint64(RoughtimeServer.__datetime_to_timestamp(\
-                    datetime.datetime.now()))
-            srep.add_tag(midp)
-
-            radi = RoughtimeTag('RADI')
-            radi.set_value_uint32(ref.radi)
-            srep.add_tag(radi)
             reply.add_tag(srep)
-
-            sig = RoughtimeTag('SIG', ref.pkey.sign(
-                    RoughtimeServer.SIGNED_RESPONSE_CONTEXT
-                            + srep.get_value_bytes()))
             reply.add_tag(sig)
-
-            ref.sock.sendto(reply.get_value_bytes(), addr)
+            replies.append((reply.get_value_bytes(), addr))
+        return replies
 
     @staticmethod
     def create_key():
@@ -233,9 +329,9 @@ class RoughtimeServer:
             priv (bytes): A base64 encoded ed25519 private key.
             publ (bytes): A base64 encoded ed25519 public key.
         '''
-        priv, publ = ed25519.create_keypair()
-        return base64.b64encode(priv.to_bytes()), \
-                base64.b64encode(publ.to_bytes())
+        priv = nacl.signing.SigningKey.generate()
+        return base64.b64encode(priv.encode()), \
+                base64.b64encode(priv.verify_key.encode())
 
     @staticmethod
     def create_delegate_key(priv, mint=None, maxt=None):
@@ -259,21 +355,21 @@ class RoughtimeServer:
         if maxt == None or maxt <= mint:
             maxt = RoughtimeServer.__datetime_to_timestamp(\
                     datetime.datetime.now() + datetime.timedelta(days=30))
-        priv = ed25519.SigningKey(priv, encoding='base64')
-        dpriv, dpubl = ed25519.create_keypair()
+        priv = nacl.signing.SigningKey(base64.b64decode(priv))
+        dpriv = nacl.signing.SigningKey.generate()
         mint_tag = RoughtimeTag('MINT')
         maxt_tag = RoughtimeTag('MAXT')
         mint_tag.set_value_uint64(mint)
         maxt_tag.set_value_uint64(maxt)
         pubk = RoughtimeTag('PUBK')
-        pubk.set_value_bytes(dpubl.to_bytes())
+        pubk.set_value_bytes(dpriv.verify_key.encode())
         dele = RoughtimePacket(key='DELE')
         dele.add_tag(mint_tag)
         dele.add_tag(maxt_tag)
         dele.add_tag(pubk)
 
         delesig = priv.sign(RoughtimeServer.CERTIFICATE_CONTEXT
-                + dele.get_value_bytes())
+                + dele.get_value_bytes()).signature
         sig = RoughtimeTag('SIG', delesig)
 
         cert = RoughtimePacket('CERT')
@@ -281,7 +377,7 @@ class RoughtimeServer:
         cert.add_tag(sig)
 
         return base64.b64encode(cert.get_value_bytes()), \
-                base64.b64encode(dpriv.to_bytes())
+                base64.b64encode(dpriv.encode())
 
     @staticmethod
     def test_server():
@@ -308,7 +404,7 @@ class RoughtimeClient:
         max_history_len (int): The number of previous replies to keep.
     '''
     def __init__(self, max_history_len=100):
-        self.prev_replies = []
+        self.prev_replies = collections.deque(maxlen=max_history_len)
         self.max_history_len = max_history_len
 
     @staticmethod
@@ -323,10 +419,10 @@ class RoughtimeClient:
 
     @staticmethod
     def __udp_query(address, port, packet, timeout):
+        data = None
         for family, type_, proto, canonname, sockaddr in \
                 socket.getaddrinfo(address, port, type=socket.SOCK_DGRAM):
             sock = socket.socket(family, socket.SOCK_DGRAM)
-            sock.settimeout(0.001)
             try:
                 sock.sendto(packet, (sockaddr[0], sockaddr[1]))
             except Exception as ex:
@@ -334,25 +430,30 @@ class RoughtimeClient:
                 sock.close()
                 continue
 
-            # Wait for reply
+            # Wait for reply, blocking on the socket for the time remaining
+            # until the timeout instead of polling.
             start_time = time.monotonic()
-            while time.monotonic() - start_time < timeout:
+            while True:
+                remaining = timeout - (time.monotonic() - start_time)
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
                 try:
                     data, repl = sock.recvfrom(1500)
-                    repl_addr = repl[0]
-                    repl_port = repl[1]
                 except socket.timeout:
-                    continue
-                if repl_addr == sockaddr[0] and repl_port == sockaddr[1]:
                     break
+                if repl[0] == sockaddr[0] and repl[1] == sockaddr[1]:
+                    break
+                # Ignore packets from other sources.
+                data = None
             rtt = time.monotonic() - start_time
             sock.close()
-            if rtt >= timeout:
+            if data == None:
                 # Try next IP on timeout.
                 continue
             # Break out of loop if successful.
             break
-        if rtt >= timeout:
+        if data == None:
             raise RoughtimeError('Timeout while waiting for reply.')
         reply = RoughtimePacket(packet=data)
 
@@ -360,6 +461,7 @@ class RoughtimeClient:
 
     @staticmethod
     def __tcp_query(address, port, packet, timeout):
+        data = None
         for family, type_, proto, canonname, sockaddr in \
                 socket.getaddrinfo(address, port, type=socket.SOCK_STREAM):
             sock = socket.socket(family, socket.SOCK_STREAM)
@@ -372,14 +474,19 @@ class RoughtimeClient:
                 sock.close()
                 continue
 
-            # Wait for reply
+            # Wait for reply, blocking on the socket for the time remaining
+            # until the timeout instead of polling.
             start_time = time.monotonic()
             buf = bytes()
-            while time.monotonic() - start_time < timeout:
+            while data == None:
+                remaining = timeout - (time.monotonic() - start_time)
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
                 try:
                     buf += sock.recv(4096)
                 except socket.timeout:
-                    continue
+                    break
                 if len(buf) < 12:
                     continue
                 (magic, repl_len) = struct.unpack('<QI', buf[:12])
@@ -388,15 +495,14 @@ class RoughtimeClient:
                 if repl_len + 12 > len(buf):
                     continue
                 data = buf[:repl_len + 12]
-                break
             rtt = time.monotonic() - start_time
             sock.close()
-            if rtt >= timeout:
+            if data == None:
                 # Try next IP on timeout.
                 continue
             # Break out of loop if successful.
             break
-        if rtt >= timeout:
+        if data == None:
             raise RoughtimeError('Timeout while waiting for reply.')
         reply = RoughtimePacket(packet=data)
 
@@ -439,7 +545,7 @@ class RoughtimeClient:
         if protocol != 'udp' and protocol != 'tcp':
             raise RoughtimeError('Illegal protocol type.')
 
-        pubkey = ed25519.VerifyingKey(pubkey, encoding='base64')
+        pubkey = nacl.signing.VerifyKey(base64.b64decode(pubkey))
 
         # Generate nonce.
         blind = os.urandom(64)
@@ -507,8 +613,8 @@ class RoughtimeClient:
 
         # Verify signature of DELE with long term certificate.
         try:
-            pubkey.verify(dsig, RoughtimeServer.CERTIFICATE_CONTEXT
-                    + dele.get_received())
+            pubkey.verify(RoughtimeServer.CERTIFICATE_CONTEXT
+                    + dele.get_received(), dsig)
         except:
             raise RoughtimeError('Verification of long term certificate '
                     + 'signature failed.')
@@ -531,15 +637,20 @@ class RoughtimeClient:
         if pathlen > 32:
             raise RoughtimeError('Too many paths in Merkle tree.')
 
-        while len(path) > 0:
+        # Reuse a single preallocated hash input buffer instead of
+        # concatenating fresh bytes objects for every tree level.
+        hashbuf = bytearray(1 + 2 * node_size)
+        hashbuf[0] = 0x01
+        pathview = memoryview(path)
+        for level in range(pathlen):
+            offset = level * node_size
             if indx & 1 == 0:
-                curr_hash = hashlib.sha512(b'\x01' + curr_hash
-                        + path[:node_size]).digest()
+                hashbuf[1:1 + node_size] = curr_hash
+                hashbuf[1 + node_size:] = pathview[offset:offset + node_size]
             else:
-                curr_hash = hashlib.sha512(b'\x01' + path[:node_size]
-                        + curr_hash).digest()
-            curr_hash = curr_hash[:node_size]
-            path = path[node_size:]
+                hashbuf[1:1 + node_size] = pathview[offset:offset + node_size]
+                hashbuf[1 + node_size:] = curr_hash
+            curr_hash = hashlib.sha512(hashbuf).digest()[:node_size]
             indx >>= 1
 
         if indx != 0:
@@ -548,16 +659,17 @@ class RoughtimeClient:
             raise RoughtimeError('Final Merkle tree value not equal to ROOT.')
 
         # Verify that DELE signature of SREP is valid.
-        delekey = ed25519.VerifyingKey(pubk)
+        delekey = nacl.signing.VerifyKey(pubk)
         try:
-            delekey.verify(sig, RoughtimeServer.SIGNED_RESPONSE_CONTEXT
-                    + srep.get_received())
+            delekey.verify(RoughtimeServer.SIGNED_RESPONSE_CONTEXT
+                    + srep.get_received(), sig)
         except:
             raise RoughtimeError('Bad DELE key signature.')
 
-        self.prev_replies.append((nonce, blind, data))
-        while len(self.prev_replies) > self.max_history_len:
-            self.prev_replies = self.prev_replies[1:]
+        # Store the reply's midpoint and accuracy as well, so
+        # verify_replies does not have to re-parse the packet. The deque
+        # evicts the oldest entry when the history is full.
+        self.prev_replies.append((nonce, blind, data, midp, radi))
 
         # Return results.
         ret = dict()
@@ -584,12 +696,13 @@ class RoughtimeClient:
         Returns a list of previous replies recived by the instance.
 
         Returns:
-            prev_replies (list): A list of tuples (bytes, bytes, bytes)
-                    containing a nonce, the blind used to generate the nonce,
-                    and the data received from the server in the reply. The
-                    list is in chronological order.
+            prev_replies (list): A list of tuples (bytes, bytes, bytes, int,
+                    int) containing a nonce, the blind used to generate the
+                    nonce, the data received from the server in the reply,
+                    and the reply's midpoint (MIDP) and accuracy (RADI) in
+                    microseconds. The list is in chronological order.
         '''
-        return self.prev_replies
+        return list(self.prev_replies)
 
     def verify_replies(self):
         '''
@@ -600,21 +713,32 @@ class RoughtimeClient:
                     pairs. An empty list indicates that no replies appear to
                     violate causality.
         '''
+        # The midpoint and accuracy were extracted when the replies were
+        # received, so no parsing is necessary here.
+        lower = []
+        upper = []
+        for nonce, blind, data, midp, radi in self.prev_replies:
+            midp = RoughtimeClient.midp_to_datetime(midp)
+            radi = datetime.timedelta(microseconds=radi)
+            lower.append(midp - radi)
+            upper.append(midp + radi)
+        # A pair (i, k) with k > i is invalid when lower[i] > upper[k].
+        # Compare each lower bound against a suffix minimum of the upper
+        # bounds, so the expected case with no violations is a single
+        # O(n) sweep. Offending pairs are only enumerated when found.
+        n = len(lower)
+        suffix_min = [None] * n
+        for i in range(n - 1, -1, -1):
+            if i == n - 1 or upper[i] < suffix_min[i + 1]:
+                suffix_min[i] = upper[i]
+            else:
+                suffix_min[i] = suffix_min[i + 1]
         invalid_pairs = []
-        for i in range(len(self.prev_replies)):
-            packet_i = RoughtimePacket(packet=self.prev_replies[i][2])
-            midp_i = RoughtimeClient.midp_to_datetime(\
-                    packet_i.get_tag('SREP').get_tag('MIDP').to_int())
-            radi_i = datetime.timedelta(microseconds=packet_i.get_tag('SREP')\
-                    .get_tag('RADI').to_int())
-            for k in range(i + 1, len(self.prev_replies)):
-                packet_k = RoughtimePacket(packet=self.prev_replies[k][2])
-                midp_k = RoughtimeClient.midp_to_datetime(\
-                        packet_k.get_tag('SREP').get_tag('MIDP').to_int())
-                radi_k = datetime.timedelta(microseconds=\
-                        packet_k.get_tag('SREP').get_tag('RADI').to_int())
-                if midp_i - radi_i > midp_k + radi_k:
-                    invalid_pairs.append((i, k))
+        for i in range(n - 1):
+            if lower[i] > suffix_min[i + 1]:
+                for k in range(i + 1, n):
+                    if lower[i] > upper[k]:
+                        invalid_pairs.append((i, k))
         return invalid_pairs
 
 class RoughtimeTag:
@@ -627,12 +751,21 @@ class RoughtimeTag:
                 NULL characters.
         value (bytes): The tag's value.
     '''
+    # Precomputed encodings of the known tag keys, so serialization does
+    # not have to re-encode them for every tag in every packet.
+    KNOWN_TAG_BYTES = {x: x.encode('latin-1') for x in (
+            'SIG\x00', 'INDX', 'PATH', 'ROOT', 'MIDP', 'RADI', 'PAD\x00',
+            'PAD\xff', 'NONC', 'MINT', 'MAXT', 'PUBK', 'VER\x00', 'DTAI',
+            'DUT1', 'LEAP', 'SREP', 'CERT', 'DELE')}
+
     def __init__(self, key, value=b''):
         if len(key) > 4:
             raise ValueError
         while len(key) < 4:
             key += '\x00'
         self.key = key
+        self.key_bytes = RoughtimeTag.KNOWN_TAG_BYTES.get(key) \
+                or key.encode('latin-1')
         assert len(value) % 4 == 0
         self.value = value
 
@@ -666,7 +799,7 @@ class RoughtimeTag:
     def get_tag_bytes(self):
         'Returns the tag as an encoded uint32.'
         assert len(self.key) == 4
-        return RoughtimeTag.tag_str_to_uint32(self.key)
+        return self.key_bytes
 
     def get_value_len(self):
         'Returns the number of bytes in the tag\'s value.'
@@ -737,10 +870,19 @@ class RoughtimePacket(RoughtimeTag):
         RoughtimeError: On any error. The message will describe the specific
                 error that occurred.
     '''
+    LEAF_TAGS = frozenset(('SIG\x00', 'INDX', 'PATH', 'ROOT', 'MIDP',
+            'RADI', 'PAD\x00', 'PAD\xff', 'NONC', 'MINT', 'MAXT', 'PUBK',
+            'VER\x00', 'DTAI', 'DUT1', 'LEAP'))
+    PARENT_TAGS = frozenset(('SREP', 'CERT', 'DELE'))
+
     def __init__(self, key='\x00\x00\x00\x00', packet=None):
         self.tags = []
+        self.tag_map = {}
         self.key = key
+        self.key_bytes = RoughtimeTag.KNOWN_TAG_BYTES.get(key) \
+                or key.encode('latin-1')
         self.packet = None
+        self._serialized = None
 
         # Return if there is no packet to parse.
         if packet == None:
@@ -751,14 +893,17 @@ class RoughtimePacket(RoughtimeTag):
         if len(packet) % 4 != 0:
             raise RoughtimeError('Packet size is not a multiple of four.')
 
-        if RoughtimePacket.unpack_uint64(packet, 0) == 0x4d49544847554f52:
-            if len(packet) - 12 != RoughtimePacket.unpack_uint32(packet, 8):
+        # Parse through a memoryview so header fields and tag values do
+        # not copy the packet; bytes are only copied out once per tag.
+        view = memoryview(packet)
+        if RoughtimePacket.unpack_uint64(view, 0) == 0x4d49544847554f52:
+            if len(packet) - 12 != RoughtimePacket.unpack_uint32(view, 8):
                 raise RoughtimeError('Bad packet size.')
-            packet = packet[12:]
+            view = view[12:]
 
-        num_tags = RoughtimePacket.unpack_uint32(packet, 0)
+        num_tags = RoughtimePacket.unpack_uint32(view, 0)
         headerlen = 8 * num_tags
-        if headerlen > len(packet):
+        if headerlen > len(view):
             raise RoughtimeError('Bad packet size.')
         # Iterate over the tags.
         for i in range(num_tags):
@@ -766,40 +911,42 @@ class RoughtimePacket(RoughtimeTag):
             if i == 0:
                 offset = headerlen
             else:
-                offset = RoughtimePacket.unpack_uint32(packet, i * 4) \
+                offset = RoughtimePacket.unpack_uint32(view, i * 4) \
                         + headerlen
-            if offset > len(packet):
+            if offset > len(view):
                 raise RoughtimeError('Bad packet size.')
 
             # Tag value end.
             if i == num_tags - 1:
-                end = len(packet)
+                end = len(view)
             else:
-                end = RoughtimePacket.unpack_uint32(packet, (i + 1) * 4) \
+                end = RoughtimePacket.unpack_uint32(view, (i + 1) * 4) \
                         + headerlen
-            if end > len(packet):
+            if end > len(view):
                 raise RoughtimeError('Bad packet size.')
 
             # Tag key string.
             key = RoughtimeTag.tag_uint32_to_str(
-                    RoughtimePacket.unpack_uint32(packet, (num_tags + i) * 4))
-
-            value = packet[offset:end]
+                    RoughtimePacket.unpack_uint32(view, (num_tags + i) * 4))
 
-            leaf_tags = ['SIG\x00', 'INDX', 'PATH', 'ROOT', 'MIDP', 'RADI',
-                    'PAD\x00', 'PAD\xff', 'NONC', 'MINT', 'MAXT', 'PUBK',
-                    'VER\x00', 'DTAI', 'DUT1', 'LEAP']
-            parent_tags = ['SREP', 'CERT', 'DELE']
             if self.contains_tag(key):
                 raise RoughtimeError('Encountered duplicate tag: %s' % key)
-            if key in leaf_tags:
-                self.add_tag(RoughtimeTag(key, packet[offset:end]))
-            elif key in parent_tags:
+            if key in RoughtimePacket.LEAF_TAGS:
+                self.add_tag(RoughtimeTag(key, bytes(view[offset:end])))
+            elif key in RoughtimePacket.PARENT_TAGS:
                 # Unpack parent tags recursively.
-                self.add_tag(RoughtimePacket(key, packet[offset:end]))
+                self.add_tag(RoughtimePacket(key, bytes(view[offset:end])))
             else:
                 raise RoughtimeError('Encountered unknown tag: %s' % key)
 
+        # The serialized form of a parsed packet is the received packet
+        # itself, so seed the serialization cache with it instead of
+        # reserializing the tag list on the first get_value_bytes call.
+        if len(view) == len(packet):
+            self._serialized = packet
+        else:
+            self._serialized = bytes(view)
+
     def add_tag(self, tag):
         '''
         Adds a tag to the packet:
@@ -811,12 +958,13 @@ class RoughtimePacket(RoughtimeTag):
             RoughtimeError: If a tag with the same key already exists in the
                     packet.
         '''
-        for t in self.tags:
-            if t.get_tag_str() == tag.get_tag_str():
-                raise RoughtimeError('Attempted to add two tags with same key '
-                        + 'to RoughtimePacket.')
+        if tag.get_tag_str() in self.tag_map:
+            raise RoughtimeError('Attempted to add two tags with same key '
+                    + 'to RoughtimePacket.')
         self.tags.append(tag)
         self.tags.sort(key=lambda x: struct.unpack('<I', x.get_tag_bytes()))
+        self.tag_map[tag.get_tag_str()] = tag
+        self._serialized = None
 
     def contains_tag(self, tag):
         '''
@@ -832,10 +980,7 @@ class RoughtimePacket(RoughtimeTag):
             raise ValueError
         while len(tag) < 4:
             tag += '\x00'
-        for t in self.tags:
-            if t.get_tag_str() == tag:
-                return True
-        return False
+        return tag in self.tag_map
 
     def get_tag(self, tag):
         '''
@@ -851,10 +996,7 @@ class RoughtimePacket(RoughtimeTag):
             raise RoughtimeError('Invalid tag key length.')
         while len(tag) < 4:
             tag += '\x00'
-        for t in self.tags:
-            if t.get_tag_str() == tag:
-                return t
-        return None
+        return self.tag_map.get(tag)
 
     def get_tags(self):
         'Returns a list of all tag keys in the packet.'
@@ -866,16 +1008,27 @@ class RoughtimePacket(RoughtimeTag):
 
     def get_value_bytes(self, packet_header=False):
         'Returns the raw byte string representing the value of the tag.'
-        packet = struct.pack('<I', len(self.tags))
-        offset = 0
-        for tag in self.tags[:-1]:
-            offset += tag.get_value_len()
-            packet += struct.pack('<I', offset)
-        for tag in self.tags:
-            packet += tag.get_tag_bytes()
-        for tag in self.tags:
-            packet += tag.get_value_bytes()
-        assert len(packet) % 4 == 0
+        if self._serialized == None:
+            values = [tag.get_value_bytes() for tag in self.tags]
+            num_tags = len(self.tags)
+            header_len = 4 + 4 * max(num_tags - 1, 0) + 4 * num_tags
+            buf = bytearray(header_len + sum(len(x) for x in values))
+            struct.pack_into('<I', buf, 0, num_tags)
+            pos = 4
+            offset = 0
+            for value in values[:-1]:
+                offset += len(value)
+                struct.pack_into('<I', buf, pos, offset)
+                pos += 4
+            for tag in self.tags:
+                buf[pos:pos + 4] = tag.get_tag_bytes()
+                pos += 4
+            for value in values:
+                buf[pos:pos + len(value)] = value
+                pos += len(value)
+            assert pos % 4 == 0
+            self._serialized = bytes(buf)
+        packet = self._serialized
         if packet_header:
             packet = struct.pack('<QI', 0x4d49544847554f52, len(packet)) + packet
         return packet
@@ -900,12 +1053,12 @@ class RoughtimePacket(RoughtimeTag):
     @staticmethod
     def unpack_uint32(buf, offset):
         'Utility function for parsing server replies.'
-        return struct.unpack('<I', buf[offset:offset + 4])[0]
+        return _UINT32.unpack_from(buf, offset)[0]
 
     @staticmethod
     def unpack_uint64(buf, offset):
         'Utility function for parsing server replies.'
-        return struct.unpack('<Q', buf[offset:offset + 8])[0]
+        return _UINT64.unpack_from(buf, offset)[0]
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Query Roughtime servers '